@@ -1,9 +1,12 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, url_for
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import json
+from functools import lru_cache
 
 from src.helper import download_hugging_face_embeddings
+from src.pidfile import acquire_pid_file
 from src.prompt import *
 
 from langchain_pinecone import PineconeVectorStore
@@ -58,9 +61,34 @@ rag_chain = (
 
 
 
+CHAT_TEMPLATE_PATH = os.path.join(app.root_path, "templates", "chat.html")
+
+
+@lru_cache(maxsize=4)
+def _render_chatbot_html(api_url, mtime):
+    with open(CHAT_TEMPLATE_PATH, "r", encoding="utf-8") as f:
+        html = f.read()
+    # Embed as a JS string literal; escape '<' so the value can't close the <script>
+    url_literal = json.dumps(api_url).replace("<", "\\u003c")
+    return html.replace('url: "%API_URL%"', f'url: {url_literal}')
+
+
+def get_chatbot_html(api_url):
+    """Return chat.html with the chat endpoint URL filled in (memoized per URL and template mtime)"""
+    return _render_chatbot_html(api_url, os.path.getmtime(CHAT_TEMPLATE_PATH))
+
+
+
 @app.route("/")
 def index():
-    return render_template('chat.html')
+    # chat.html has no Jinja markup, only the %API_URL% placeholder for the chat endpoint
+    return get_chatbot_html(url_for("chat"))
+
+
+
+@app.route("/health")
+def health():
+    return "OK"
 
 
 
@@ -77,4 +105,5 @@ def chat():
 
 
 if __name__ == '__main__':
+    acquire_pid_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".flask_pid"))
     app.run(host="0.0.0.0", port= 8080, debug= True)
@@ -11,36 +11,386 @@ import time
 import atexit
 import socket
 import platform
+import functools
+import re
+import shutil
+import select
+import errno
+import struct
+
+from src.pidfile import pid_file_owner_alive
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PID_FILE = os.path.join(BASE_DIR, ".flask_pid")
 
-# Detect if running in cloud environment
-IS_CLOUD = os.getenv("CLOUD_ENV") == "true" or os.path.exists("/.dockerenv") or os.path.exists("/run/.containerenv")
+@functools.cache
+def is_cloud():
+    """Detect if running in a cloud/container environment (evaluated once)"""
+    if os.getenv("CLOUD_ENV") is not None:
+        return os.getenv("CLOUD_ENV") == "true"
+    if os.getenv("KUBERNETES_SERVICE_HOST") or os.getenv("container"):
+        return True
+    # Plain Docker sets no marker variable; fall back to its marker files
+    return os.path.exists("/.dockerenv") or os.path.exists("/run/.containerenv")
+
 IS_WINDOWS = sys.platform == "win32"
+IS_LINUX = sys.platform.startswith("linux")
+IS_MACOS = sys.platform == "darwin"
+
+# TCP state code for LISTEN in /proc/net/tcp (see proc(5))
+TCP_LISTEN = "0A"
+SS_PID_PATTERN = re.compile(r"pid=(\d+)")
+# Matches "  TCP    0.0.0.0:8080    0.0.0.0:0    LISTENING    1234" in raw `netstat -ano` output
+NETSTAT_LISTEN_PATTERN = re.compile(rb"^\s*TCP\s+\S+:(\d+)\s+\S+\s+LISTENING\s+(\d+)", re.MULTILINE)
+CONNECT_PENDING = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN}
+
+def is_port_in_use(port, timeout=0.05):
+    """Check if port is in use
 
-def is_port_in_use(port):
-    """Check if port is in use"""
+    Uses a non-blocking connect to 127.0.0.1 (no DNS lookup) bounded by
+    a short select; on loopback a free port answers with RST immediately.
+    """
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            result = s.connect_ex(('localhost', port))
+            # Reset instead of leaving a TIME_WAIT socket behind for each probe
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            s.setblocking(False)
+            result = s.connect_ex(('127.0.0.1', port))
+            if result in CONNECT_PENDING:
+                # Windows reports a refused connect via the exception set
+                _, writable, failed = select.select([], [s], [s], timeout)
+                if not writable and not failed:
+                    return False
+                result = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
             return result == 0
     except Exception as e:
         print(f"   - Port check failed: {e}")
         return False
 
+def _find_pids_listening_on_port_linux(port):
+    """Find PIDs listening on the given port by reading /proc directly (no subprocess)
+
+    Returns None if /proc/net is not readable so callers can fall back.
+    """
+    inodes = set()
+    readable = False
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, "r") as f:
+                readable = True
+                next(f, None)  # Skip header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != TCP_LISTEN:
+                        continue
+                    if int(fields[1].rsplit(":", 1)[1], 16) == port and fields[9] != "0":
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    
+    if not readable:
+        return None
+    if not inodes:
+        return set()
+    
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    pids = set()
+    with os.scandir("/proc") as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with os.scandir(f"/proc/{entry.name}/fd") as fds:
+                    for fd in fds:
+                        try:
+                            if os.readlink(fd.path) in targets:
+                                pids.add(int(entry.name))
+                                break
+                        except OSError:
+                            continue  # fd closed while scanning
+            except OSError:
+                continue  # Process exited or not ours to inspect
+    return pids
+
+def _find_pids_listening_on_port_ss(port):
+    """Find PIDs listening on the given port using ss (kernel-filtered via netlink)"""
+    result = subprocess.run(
+        ["ss", "-H", "-ltnp", "sport = :%d" % port],
+        capture_output=True,
+        text=True,
+        timeout=2
+    )
+    return {int(pid) for pid in SS_PID_PATTERN.findall(result.stdout)}
+
+def _find_pids_listening_on_port_lsof(port):
+    """Find PIDs listening on the given port using lsof (macOS/BSD, where there is no ss)"""
+    result = subprocess.run(
+        ["lsof", "-nP", "-t", f"-iTCP:{port}", "-sTCP:LISTEN"],
+        capture_output=True,
+        text=True,
+        timeout=5
+    )
+    return {int(pid) for pid in result.stdout.split() if pid.isdigit()}
+
+def _find_pids_listening_on_port(port):
+    """Find PIDs listening on the given port, cheapest method first"""
+    if IS_LINUX:
+        pids = _find_pids_listening_on_port_linux(port)
+        if pids is not None:
+            return pids
+    if shutil.which("ss"):
+        return _find_pids_listening_on_port_ss(port)
+    if shutil.which("lsof"):
+        return _find_pids_listening_on_port_lsof(port)
+    return set()
+
+def _wait_for_exit_windows(pid, timeout):
+    """Block on the process handle until it exits or the timeout elapses"""
+    import ctypes
+    SYNCHRONIZE = 0x00100000
+    WAIT_TIMEOUT = 0x00000102
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(SYNCHRONIZE, False, pid)
+    if not handle:
+        return True  # No such process
+    try:
+        return kernel32.WaitForSingleObject(handle, int(timeout * 1000)) != WAIT_TIMEOUT
+    finally:
+        kernel32.CloseHandle(handle)
+
+def _wait_for_exit(pid, timeout=2.0):
+    """Wait until the process exits; returns True if it exited within the timeout
+
+    Uses pidfd (Linux), kqueue (macOS) or a process handle (Windows) so the
+    wait returns as soon as the process dies instead of polling.
+    """
+    if IS_WINDOWS:
+        return _wait_for_exit_windows(pid, timeout)
+    
+    if IS_LINUX and hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pidfd = None  # pidfd_open not supported by this kernel
+        if pidfd is not None:
+            try:
+                readable, _, _ = select.select([pidfd], [], [], timeout)
+                return bool(readable)
+            finally:
+                os.close(pidfd)
+    
+    if IS_MACOS:
+        kq = select.kqueue()
+        try:
+            event = select.kevent(
+                pid,
+                filter=select.KQ_FILTER_PROC,
+                flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                fflags=select.KQ_NOTE_EXIT
+            )
+            try:
+                return bool(kq.control([event], 1, timeout))
+            except ProcessLookupError:
+                return True
+        finally:
+            kq.close()
+    
+    # Fallback: short-interval liveness polling
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass  # Alive but owned by another user
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+
+def _terminate_pid(pid):
+    """Send SIGTERM, then SIGKILL if the process does not exit promptly"""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        if not _wait_for_exit(pid):
+            os.kill(pid, signal.SIGKILL)
+            _wait_for_exit(pid)
+    except ProcessLookupError:
+        pass  # Process already dead
+
+def _find_pids_listening_on_port_windows(port):
+    """Find PIDs listening on the given port via iphlpapi.GetExtendedTcpTable (no subprocess)"""
+    import ctypes
+    from ctypes import wintypes
+    
+    class MIB_TCPROW_OWNER_PID(ctypes.Structure):
+        _fields_ = [
+            ("dwState", wintypes.DWORD),
+            ("dwLocalAddr", wintypes.DWORD),
+            ("dwLocalPort", wintypes.DWORD),
+            ("dwRemoteAddr", wintypes.DWORD),
+            ("dwRemotePort", wintypes.DWORD),
+            ("dwOwningPid", wintypes.DWORD),
+        ]
+    
+    class MIB_TCP6ROW_OWNER_PID(ctypes.Structure):
+        _fields_ = [
+            ("ucLocalAddr", ctypes.c_ubyte * 16),
+            ("dwLocalScopeId", wintypes.DWORD),
+            ("dwLocalPort", wintypes.DWORD),
+            ("ucRemoteAddr", ctypes.c_ubyte * 16),
+            ("dwRemoteScopeId", wintypes.DWORD),
+            ("dwRemotePort", wintypes.DWORD),
+            ("dwState", wintypes.DWORD),
+            ("dwOwningPid", wintypes.DWORD),
+        ]
+    
+    TCP_TABLE_OWNER_PID_LISTENER = 3
+    ERROR_INSUFFICIENT_BUFFER = 122
+    get_table = ctypes.windll.iphlpapi.GetExtendedTcpTable
+    local_port = socket.htons(port)
+    pids = set()
+    for family, row_type in ((socket.AF_INET, MIB_TCPROW_OWNER_PID),
+                             (socket.AF_INET6, MIB_TCP6ROW_OWNER_PID)):
+        size = wintypes.DWORD(0)
+        ret = ERROR_INSUFFICIENT_BUFFER
+        while ret == ERROR_INSUFFICIENT_BUFFER:  # Table may grow between calls
+            buf = ctypes.create_string_buffer(size.value or 1)
+            ret = get_table(buf, ctypes.byref(size), False, family, TCP_TABLE_OWNER_PID_LISTENER, 0)
+        if ret != 0:
+            raise ctypes.WinError(ret)
+        count = wintypes.DWORD.from_buffer(buf).value
+        rows = (row_type * count).from_buffer(buf, ctypes.sizeof(wintypes.DWORD))
+        pids.update(row.dwOwningPid for row in rows if row.dwLocalPort & 0xFFFF == local_port)
+    return pids
+
+def _windows_descendants(pid):
+    """List all descendant PIDs of a process from a CreateToolhelp32Snapshot process snapshot"""
+    import ctypes
+    from ctypes import wintypes
+    
+    class PROCESSENTRY32(ctypes.Structure):
+        _fields_ = [
+            ("dwSize", wintypes.DWORD),
+            ("cntUsage", wintypes.DWORD),
+            ("th32ProcessID", wintypes.DWORD),
+            ("th32DefaultHeapID", ctypes.c_void_p),
+            ("th32ModuleID", wintypes.DWORD),
+            ("cntThreads", wintypes.DWORD),
+            ("th32ParentProcessID", wintypes.DWORD),
+            ("pcPriClassBase", ctypes.c_long),
+            ("dwFlags", wintypes.DWORD),
+            ("szExeFile", ctypes.c_char * 260),
+        ]
+    
+    TH32CS_SNAPPROCESS = 0x00000002
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    snapshot = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPPROCESS, 0)
+    if snapshot == INVALID_HANDLE_VALUE:
+        raise ctypes.WinError(ctypes.get_last_error())
+    
+    children = {}
+    try:
+        entry = PROCESSENTRY32()
+        entry.dwSize = ctypes.sizeof(PROCESSENTRY32)
+        more = kernel32.Process32First(snapshot, ctypes.byref(entry))
+        while more:
+            children.setdefault(entry.th32ParentProcessID, []).append(entry.th32ProcessID)
+            more = kernel32.Process32Next(snapshot, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snapshot)
+    
+    descendants = []
+    queue = [pid]
+    while queue:
+        for child in children.get(queue.pop(), []):
+            if child != pid and child not in descendants:
+                descendants.append(child)
+                queue.append(child)
+    return descendants
+
+def _terminate_pid_windows(pid):
+    """Terminate a process and its descendants (like taskkill /T) with OpenProcess + TerminateProcess"""
+    import ctypes
+    PROCESS_TERMINATE = 0x0001
+    ERROR_INVALID_PARAMETER = 87  # No such process
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    # Snapshot the tree first: e.g. the Werkzeug reloader child shares the listening socket
+    targets = [pid] + _windows_descendants(pid)
+    for target in targets:
+        handle = kernel32.OpenProcess(PROCESS_TERMINATE, False, target)
+        if not handle:
+            error = ctypes.get_last_error()
+            if error == ERROR_INVALID_PARAMETER:
+                continue
+            raise ctypes.WinError(error)
+        try:
+            if not kernel32.TerminateProcess(handle, 1):
+                raise ctypes.WinError(ctypes.get_last_error())
+        finally:
+            kernel32.CloseHandle(handle)
+    for target in targets:
+        _wait_for_exit(target)
+
+def _kill_process_on_port_netstat(port):
+    """Kill processes listening on the given port using netstat + taskkill (Windows last resort)
+
+    Returns True if any process was killed.
+    """
+    killed = False
+    try:
+        result = subprocess.run(
+            ["netstat", "-ano"],
+            capture_output=True,
+            timeout=5
+        )
+        pids = {
+            int(match.group(2))
+            for match in NETSTAT_LISTEN_PATTERN.finditer(result.stdout)
+            if int(match.group(1)) == port
+        }
+        for pid in pids:
+            try:
+                subprocess.run(
+                    ["taskkill", "/PID", str(pid), "/F", "/T"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=5
+                )
+                print(f"   - Killed PID {pid}")
+                killed = True
+            except:
+                pass
+    except Exception as e:
+        print(f"   - Netstat kill failed: {e}")
+    return killed
+
 def kill_process_on_port(port, force=False):
-    """Kill any process listening on the given port - multiple methods"""
-    if not force and IS_CLOUD:
+    """Kill any process listening on the given port - multiple methods
+
+    Returns True if a process was killed.
+    """
+    killed = False
+    if not force and is_cloud():
         print(f"⚠️  Running in cloud environment, skipping aggressive port cleanup")
-        return
+        return killed
     
     print(f"🔥 Attempting to kill process on port {port}...")
     
     try:
-        # Method 1: Kill by PID file
-        if os.path.exists(PID_FILE):
+        # Method 1: Kill by PID file. The server holds a lock on it while
+        # running, so an unlocked file means its PID may since have been reused.
+        if os.path.exists(PID_FILE) and not pid_file_owner_alive(PID_FILE):
+            print(f"   - PID file is stale, skipping PID kill")
+            try:
+                os.remove(PID_FILE)
+            except OSError:
+                pass
+        elif os.path.exists(PID_FILE):
             try:
                 with open(PID_FILE, "r") as f:
                     pid = int(f.read().strip())
@@ -53,61 +403,70 @@ def kill_process_on_port(port, force=False):
                         stderr=subprocess.PIPE,
                         timeout=5
                     )
+                    _wait_for_exit(pid)
                 else:
                     print(f"   - Killing PID {pid} using signal...")
-                    try:
-                        os.kill(pid, signal.SIGKILL)
-                    except ProcessLookupError:
-                        pass  # Process already dead
-                time.sleep(0.5)
+                    _terminate_pid(pid)
+                killed = True
             except Exception as e:
                 print(f"   - PID kill failed: {e}")
         
-        # Method 2: Kill by port (only on Windows with force)
-        if IS_WINDOWS and force:
+        # Method 2: Kill by port (only with force). A stale PID file says nothing
+        # about the socket's real owner (e.g. an orphaned reloader child), so
+        # only the port probe decides; a free port never spawns netstat/taskkill/ss
+        kill_by_port = force and is_port_in_use(port)
+        if kill_by_port and not IS_WINDOWS:
             try:
-                print(f"   - Killing process on port {port} using netstat...")
-                result = subprocess.run(
-                    ["netstat", "-ano"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                for line in result.stdout.split('\n'):
-                    if f":{port}" in line and "LISTENING" in line:
-                        parts = line.split()
-                        if parts:
-                            pid = parts[-1]
-                            try:
-                                subprocess.run(
-                                    ["taskkill", "/PID", pid, "/F", "/T"],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    timeout=5
-                                )
-                                print(f"   - Killed PID {pid}")
-                            except:
-                                pass
+                print(f"   - Killing process on port {port}...")
+                for pid in _find_pids_listening_on_port(port):
+                    _terminate_pid(pid)
+                    print(f"   - Killed PID {pid}")
+                    killed = True
             except Exception as e:
-                print(f"   - Netstat kill failed: {e}")
-        
-        # Method 3: Verify port is released (only check, don't force)
-        if not IS_CLOUD:
-            for attempt in range(5):
-                if not is_port_in_use(port):
-                    print(f"✓ Port {port} is now free")
-                    return
-                time.sleep(0.5)
+                print(f"   - Port kill failed: {e}")
+        elif kill_by_port and IS_WINDOWS:
+            try:
+                print(f"   - Killing process on port {port} using TerminateProcess...")
+                for pid in _find_pids_listening_on_port_windows(port):
+                    _terminate_pid_windows(pid)
+                    print(f"   - Killed PID {pid}")
+                    killed = True
+            except OSError as e:
+                print(f"   - Win32 kill failed ({e}), falling back to netstat...")
+                killed = _kill_process_on_port_netstat(port) or killed
         
-        if is_port_in_use(port) and force:
+        # Method 3: Verify port is released (exits were already awaited above)
+        if not is_port_in_use(port):
+            print(f"✓ Port {port} is now free")
+        elif force:
             print(f"⚠️  Warning: Port {port} still in use after cleanup attempts")
         else:
             print(f"✓ Port cleanup completed")
     
     except Exception as e:
         print(f"⚠️  Error during port cleanup: {e}")
-        if not IS_CLOUD:
+        if not is_cloud():
             raise
+    
+    return killed
+
+def wait_for_port_release(port, timeout=0.5):
+    """Wait until the port can be bound again; returns immediately when it is free"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                # On Windows SO_REUSEADDR would let us bind over a live listener
+                if not IS_WINDOWS:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                # Bind the wildcard address Flask uses (host="0.0.0.0"): on BSD/macOS a
+                # specific-address bind succeeds alongside a live wildcard listener
+                s.bind(('0.0.0.0', port))
+            return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
 
 def cleanup():
     """Cleanup Flask server on exit"""
@@ -128,41 +487,58 @@ def signal_handler(signum, frame):
     cleanup()
     sys.exit(0)
 
-# Register cleanup
-atexit.register(cleanup)
-try:
-    signal.signal(signal.SIGINT, signal_handler)
-    if not IS_WINDOWS:
-        signal.signal(signal.SIGTERM, signal_handler)
-except:
-    pass
+def register_cleanup():
+    """Register exit and signal handlers that stop the Flask server"""
+    atexit.register(cleanup)
+    try:
+        signal.signal(signal.SIGINT, signal_handler)
+        if not IS_WINDOWS:
+            signal.signal(signal.SIGTERM, signal_handler)
+    except:
+        pass
+
+def launch_streamlit():
+    """Start the Streamlit app, replacing this process where possible"""
+    args = [sys.executable, "-m", "streamlit", "run", "streamlit_app.py"]
+    if IS_WINDOWS:
+        # os.exec* on Windows spawns a new process and exits this one,
+        # detaching the console, so stay the parent and clean up afterwards
+        register_cleanup()
+        subprocess.run(args, cwd=BASE_DIR)
+    else:
+        # Replace the interpreter in-place: no wrapper process, and signals
+        # go straight to Streamlit
+        os.chdir(BASE_DIR)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, args)
 
 if __name__ == "__main__":
     try:
         # Print environment info for debugging
-        print(f"📌 Environment: {'Cloud' if IS_CLOUD else 'Local'}")
+        print(f"📌 Environment: {'Cloud' if is_cloud() else 'Local'}")
         print(f"📌 OS: {platform.system()}")
         print(f"📌 Python: {sys.version}")
         print()
         
         # Kill any existing process on port 8080 (only aggressively if not cloud)
         print("🔍 Checking for existing Flask servers...")
+        killed = False
         try:
-            kill_process_on_port(8080, force=not IS_CLOUD)
+            killed = kill_process_on_port(8080, force=not is_cloud())
         except Exception as e:
             print(f"⚠️  Warning: Could not clean up existing processes: {e}")
-            if not IS_CLOUD:
+            if not is_cloud():
                 raise
         
-        time.sleep(1)
+        # Only a server we just killed can still be holding the port
+        if killed and not wait_for_port_release(8080):
+            print("⚠️  Warning: Port 8080 could not be bound after cleanup; the Flask server may fail to start")
         
         # Start Streamlit app
         print("🚀 Starting Streamlit app...")
         print("=" * 60)
-        subprocess.run(
-            [sys.executable, "-m", "streamlit", "run", "streamlit_app.py"],
-            cwd=BASE_DIR
-        )
+        launch_streamlit()
     except KeyboardInterrupt:
         cleanup()
     except Exception as e:
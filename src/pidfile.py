@@ -0,0 +1,63 @@
+"""
+PID file ownership tracked with an OS-level lock.
+
+The owning process keeps the file locked for its whole lifetime, so if
+another process can take the lock the owner has exited and the recorded
+PID is stale (and may since have been reused by an unrelated process).
+"""
+import os
+import sys
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# Windows locks are mandatory, so lock a byte past the PID text to keep it readable
+_LOCK_OFFSET = 64
+
+# Owner descriptors stay open (and locked) until the process exits
+_held_fds = []
+
+
+def _try_lock(fd):
+    try:
+        if sys.platform == "win32":
+            os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def acquire_pid_file(path):
+    """Lock the PID file and record this process in it; False if another process owns it"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if not _try_lock(fd):
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, str(os.getpid()).encode())
+    _held_fds.append(fd)
+    return True
+
+
+def pid_file_owner_alive(path):
+    """Return True if the process that wrote the PID file still holds its lock"""
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        if not _try_lock(fd):
+            return True
+        if sys.platform == "win32":
+            # msvcrt locks must be released before close (and before any os.remove)
+            os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        return False
+    finally:
+        os.close(fd)  # On POSIX this also drops the probe's flock
@@ -1,14 +1,32 @@
 import streamlit as st
-import streamlit.components.v1 as components
 import json
 import os
+import pandas as pd
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # MUST BE FIRST STREAMLIT COMMAND
 st.set_page_config(page_title="Medical Assistant", layout="wide", initial_sidebar_state="collapsed")
 
 BASE_DIR = os.path.dirname(__file__)
 
+# Declared column types so Arrow doesn't re-infer the schema on every render
+APPOINTMENT_DTYPES = {
+    "name": "string",
+    "email": "string",
+    "phone": "string",
+    "date": "string",
+    "time": "string",
+    "reason": "string",
+}
+
 # Load environment variables
 load_dotenv()
 
@@ -23,6 +41,8 @@ def initialize_chatbot():
         from langchain_openai import ChatOpenAI
         from langchain_core.prompts import ChatPromptTemplate
         from langchain_core.runnables import RunnablePassthrough
+        import httpx
+        from importlib.util import find_spec
         
         PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
         OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
@@ -42,7 +62,14 @@ def initialize_chatbot():
         )
         
         retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-        chatModel = ChatOpenAI(model="gpt-4o")
+        # One long-lived client for every OpenAI call in this process; httpx's
+        # default 5 s keep-alive would re-handshake TLS between chat turns
+        http_client = httpx.Client(
+            http2=find_spec("h2") is not None,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=300),
+        )
+        chatModel = ChatOpenAI(model="gpt-4o", http_client=http_client)
         prompt = ChatPromptTemplate.from_messages([
             ("system", system_prompt),
             ("human", "{input}"),
@@ -54,6 +81,14 @@ def initialize_chatbot():
             | chatModel
         )
         
+        # Warm up the embedding model and the Pinecone connection so the
+        # first real question doesn't pay for model load, DNS and TLS
+        try:
+            embeddings.embed_query("warmup")
+            docsearch.similarity_search("warmup", k=1)
+        except Exception:
+            pass  # Warm-up is best effort; real queries surface errors
+        
         return rag_chain
     except Exception as e:
         st.error(f"❌ Error initializing chatbot: {e}")
@@ -63,41 +98,166 @@ def initialize_chatbot():
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 
+# Chatbot is built on the first chat message, not on page load
+if 'rag_chain' not in st.session_state:
+    st.session_state.rag_chain = None
+
+# Appointments submitted by this session whose write hasn't finished yet
+if 'pending_appointments' not in st.session_state:
+    st.session_state.pending_appointments = []
+
+def _dump_line(data):
+    """Serialize one record as a compact JSON line (bytes), preferring orjson"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+_load_line = orjson.loads if orjson is not None else json.loads
+
+def _migrate_legacy_storage(path):
+    """One-time conversion of the old JSON-array store to JSON Lines"""
+    legacy = os.path.join(BASE_DIR, "appointments.json")
+    if not os.path.exists(legacy):
+        return
+    # A bad legacy file raises here, before anything is published at path
+    with open(legacy, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            for item in items:
+                f.write(_dump_line(item))
+        # Publish the complete file atomically without clobbering an existing store
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass  # Another process created the store first
+    finally:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+
+def _create_storage(path):
+    """Create an empty store if it is missing"""
+    try:
+        open(path, "x", encoding="utf-8").close()
+    except FileExistsError:
+        pass
+
+@st.cache_resource
 def ensure_storage():
-    path = os.path.join(BASE_DIR, "appointments.json")
+    """Path of the appointments store, created (or migrated) on first use in this process"""
+    path = os.path.join(BASE_DIR, "appointments.jsonl")
     if not os.path.exists(path):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+        _migrate_legacy_storage(path)
+    _create_storage(path)
     return path
 
-def save_appointment(data):
-    path = ensure_storage()
-    with open(path, "r", encoding="utf-8") as f:
-        items = json.load(f)
-    items.append(data)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(items, f, indent=2)
+def _stat_storage(path):
+    # The store may be removed or rotated at runtime; recreate it rather than fail
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        _create_storage(path)
+        return os.stat(path)
 
-def load_appointments():
-    path = ensure_storage()
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _close_appender(appender):
+    if appender["fd"] is not None:
+        os.close(appender["fd"])
+        appender["fd"] = None
+
+@st.cache_resource
+def _get_appender():
+    """Holder for the store's append-only descriptor, shared per process"""
+    appender = {"fd": None}
+    atexit.register(_close_appender, appender)
+    return appender
+
+def _append_appointment(appender, path, data):
+    """Append one record, reopening the descriptor if the store was replaced or removed"""
+    current = _stat_storage(path)
+    fd = appender["fd"]
+    if fd is not None:
+        opened = os.fstat(fd)
+        if (opened.st_dev, opened.st_ino) != (current.st_dev, current.st_ino):
+            _close_appender(appender)
+            fd = None
+    if fd is None:
+        # O_APPEND makes each single write() land atomically at the end of the file
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        fd = appender["fd"] = os.open(path, flags, 0o644)
+    os.write(fd, _dump_line(data))
+
+@st.cache_resource
+def _get_appointment_writer():
+    """Background executor and lock for appointment writes, shared per process"""
+    executor = ThreadPoolExecutor(max_workers=2)
+    atexit.register(executor.shutdown)
+    return executor, threading.Lock()
+
+def _save_in_background(appender, path, entry, lock):
+    # The lock makes "written to file" and "marked saved" one step for readers
+    # (and serializes use of the shared descriptor)
+    with lock:
+        try:
+            _append_appointment(appender, path, entry["data"])
+            entry["saved"] = True
+        except Exception as e:
+            print(f"Error saving appointment: {e}")
+            entry["error"] = e
+
+def submit_appointment(data):
+    """Queue an appointment write off the script thread"""
+    executor, lock = _get_appointment_writer()
+    entry = {"data": data, "saved": False}
+    st.session_state.pending_appointments.append(entry)
+    # Resolve the store here: Streamlit caches shouldn't be called from worker threads
+    executor.submit(_save_in_background, _get_appender(), ensure_storage(), entry, lock)
+
+def _appointments_frame(items):
+    return pd.DataFrame(items, columns=list(APPOINTMENT_DTYPES)).astype(APPOINTMENT_DTYPES)
+
+# One entry: every append changes the key, so older entries are never hit again
+@st.cache_data(show_spinner=False, max_entries=1)
+def _appointments_df(path, mtime_ns, size):
+    """Saved appointments as a typed DataFrame; cached until the file's mtime or size changes"""
+    with open(path, "rb") as f:
+        return _appointments_frame([_load_line(line) for line in f if line.strip()])
+
+def load_appointments_with_pending():
+    """Saved appointments plus this session's not-yet-written ones, as a DataFrame
+
+    Bookings whose background write failed are reported with st.error.
+    """
+    _, lock = _get_appointment_writer()
+    with lock:
+        path = ensure_storage()
+        stat = _stat_storage(path)
+        df = _appointments_df(path, stat.st_mtime_ns, stat.st_size)
+        failed = [e for e in st.session_state.pending_appointments if "error" in e]
+        pending = [e for e in st.session_state.pending_appointments if not e["saved"] and "error" not in e]
+    st.session_state.pending_appointments = pending
+    for entry in failed:
+        appt = entry["data"]
+        st.error(f"❌ Could not save appointment for {appt['name']} on {appt['date']}: {entry['error']}")
+    if pending:
+        df = pd.concat([df, _appointments_frame([e["data"] for e in pending])], ignore_index=True)
+    return df
 
 def get_chatbot_response(message, rag_chain):
-    """Get response from the chatbot"""
+    """Stream the chatbot response as text chunks"""
     if rag_chain is None:
-        return "Sorry, the chatbot is not available. Please check API configurations."
+        yield "Sorry, the chatbot is not available. Please check API configurations."
+        return
     
     try:
-        response = rag_chain.invoke(message)
-        return response.content
+        for chunk in rag_chain.stream(message):
+            yield chunk.content
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
 
 def main():
-    # Initialize chatbot (after set_page_config)
-    rag_chain = initialize_chatbot()
-    
     st.title("Medical Assistant")
 
     col1, col2 = st.columns([1, 1])
@@ -122,15 +282,15 @@ def main():
                         "time": time.isoformat(),
                         "reason": reason,
                     }
-                    save_appointment(appt)
+                    submit_appointment(appt)
                     st.success("✅ Appointment booked successfully!")
                 else:
                     st.error("Please fill in all required fields.")
 
         st.markdown("---")
         st.subheader("📋 Upcoming Appointments")
-        items = load_appointments()
-        if items:
+        items = load_appointments_with_pending()
+        if not items.empty:
             st.dataframe(items, use_container_width=True)
         else:
             st.info("No appointments yet.")
@@ -143,9 +303,12 @@ def main():
         
         # Display chat history
         with chat_container:
+            # Placeholder so the greeting can be cleared when the first prompt arrives
+            greeting = st.empty()
             if not st.session_state.chat_history:
-                with st.chat_message("assistant"):
-                    st.write("Hello! I'm your medical assistant. How can I help you today?")
+                with greeting.container():
+                    with st.chat_message("assistant"):
+                        st.write("Hello! I'm your medical assistant. How can I help you today?")
             
             for message in st.session_state.chat_history:
                 with st.chat_message(message["role"]):
@@ -156,25 +319,27 @@ def main():
             # Add user message to chat history
             st.session_state.chat_history.append({"role": "user", "content": prompt})
             
+            # No rerun follows this turn, so drop the greeting rendered for an empty history
+            greeting.empty()
+            
             # Display user message
             with chat_container:
                 with st.chat_message("user"):
                     st.write(prompt)
             
-            # Get bot response
-            with st.spinner("Thinking..."):
-                response = get_chatbot_response(prompt, rag_chain)
-            
-            # Add assistant response to chat history
-            st.session_state.chat_history.append({"role": "assistant", "content": response})
+            # Initialize chatbot on first use so page load skips the LangChain imports
+            if st.session_state.rag_chain is None:
+                st.session_state.rag_chain = initialize_chatbot()
             
-            # Display assistant response
+            # Stream assistant response as it is generated
             with chat_container:
                 with st.chat_message("assistant"):
-                    st.write(response)
+                    response = st.write_stream(
+                        get_chatbot_response(prompt, st.session_state.rag_chain)
+                    )
             
-            # Rerun to update the display
-            st.rerun()
+            # Add assistant response to chat history
+            st.session_state.chat_history.append({"role": "assistant", "content": response})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file